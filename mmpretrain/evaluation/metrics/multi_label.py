@@ -3,12 +3,20 @@ from typing import List, Optional, Sequence, Union
 
 import numpy as np
 import torch
+import torch.nn.functional as F
 from mmengine.evaluator import BaseMetric
 from mmengine.logging import MMLogger
+from mmengine.utils import is_seq_of
 
 from mmpretrain.registry import METRICS
-from mmpretrain.structures import label_to_onehot
-from .single_label import _precision_recall_f1_support, to_tensor
+from mmpretrain.structures import format_label
+from .single_label import (_precision_recall_f1_support,
+                           _precision_recall_f1_support_from_sums, to_tensor)
+
+# The minimum number of elements in the score matrix to move the collected
+# results to ``compute_device`` before computing metrics. Smaller matrices
+# are not worth the transfer.
+COMPUTE_DEVICE_MIN_NUMEL = 1_000_000
 
 
 @METRICS.register_module()
@@ -70,6 +78,11 @@ class MultiLabelMetric(BaseMetric):
         collect_device (str): Device name used for collecting results from
             different ranks during distributed training. Must be 'cpu' or
             'gpu'. Defaults to 'cpu'.
+        compute_device (str, optional): Device name used for computing the
+            metrics from the collected results, like 'cuda'. The results are
+            moved only if the score matrix has more than
+            ``COMPUTE_DEVICE_MIN_NUMEL`` elements. Defaults to None, which
+            means computing on the device the results are collected to.
         prefix (str, optional): The prefix that will be added in the metric
             names to disambiguate homonymous metrics of different evaluators.
             If prefix is not provided in the argument, self.default_prefix
@@ -145,6 +158,7 @@ class MultiLabelMetric(BaseMetric):
                  items: Sequence[str] = ('precision', 'recall', 'f1-score'),
                  average: Optional[str] = 'macro',
                  collect_device: str = 'cpu',
+                 compute_device: Optional[str] = None,
                  prefix: Optional[str] = None) -> None:
 
         logger = MMLogger.get_current_instance()
@@ -166,6 +180,7 @@ class MultiLabelMetric(BaseMetric):
                 ' please choose from "precision", "recall", "f1-score" and ' \
                 '"support".'
         self.items = tuple(items)
+        self.compute_device = compute_device
 
         super().__init__(collect_device=collect_device, prefix=prefix)
 
@@ -179,17 +194,15 @@ class MultiLabelMetric(BaseMetric):
             data_batch: A batch of data from the dataloader.
             data_samples (Sequence[dict]): A batch of outputs from the model.
         """
-        for data_sample in data_samples:
+        num_classes = data_samples[0]['pred_score'].size()[-1]
+
+        gt_scores = _batch_gt_onehot(data_samples, num_classes)
+
+        for data_sample, gt_score in zip(data_samples, gt_scores):
             result = dict()
 
             result['pred_score'] = data_sample['pred_score'].clone()
-            num_classes = result['pred_score'].size()[-1]
-
-            if 'gt_score' in data_sample:
-                result['gt_score'] = data_sample['gt_score'].clone()
-            else:
-                result['gt_score'] = label_to_onehot(data_sample['gt_label'],
-                                                     num_classes)
+            result['gt_score'] = gt_score.clone()
 
             # Save the result to `self.results`.
             self.results.append(result)
@@ -211,6 +224,7 @@ class MultiLabelMetric(BaseMetric):
 
         target = torch.stack([res['gt_score'] for res in results])
         pred = torch.stack([res['pred_score'] for res in results])
+        pred, target = _to_compute_device(pred, target, self.compute_device)
 
         metric_res = self.calculate(
             pred,
@@ -315,6 +329,18 @@ class MultiLabelMetric(BaseMetric):
         assert average in average_options, 'Invalid `average` argument, ' \
             f'please specicy from {average_options}.'
 
+        thr = 0.5 if (thr is None and topk is None) else thr
+
+        if (pred_indices and target_indices and isinstance(pred, Sequence)
+                and isinstance(target, Sequence) and thr is not None
+                and 0 < thr <= 1):
+            # With index labels on both sides, count the confusion matrix
+            # from the indices directly instead of the onehot labels.
+            assert num_classes is not None, 'For index-type labels, ' \
+                'please specify `num_classes`.'
+            return _sparse_precision_recall_f1_support(pred, target,
+                                                       num_classes, average)
+
         def _format_label(label, is_indices):
             """format various label to torch.Tensor."""
             if isinstance(label, np.ndarray):
@@ -328,25 +354,37 @@ class MultiLabelMetric(BaseMetric):
                 if is_indices:
                     assert num_classes is not None, 'For index-type labels, ' \
                         'please specify `num_classes`.'
-                    label = torch.stack([
-                        label_to_onehot(indices, num_classes)
-                        for indices in label
-                    ])
+                    # Duplicated indices of a sample are counted once, the
+                    # same as the sparse path.
+                    label = _index_labels_to_onehot(
+                        [format_label(indices) for indices in label],
+                        num_classes).clamp_(max=1)
+                elif is_seq_of(label, torch.Tensor):
+                    label = torch.stack(label)
+                elif is_seq_of(label, np.ndarray):
+                    label = torch.from_numpy(np.stack(label))
                 else:
-                    label = torch.stack(
-                        [to_tensor(onehot) for onehot in label])
+                    # convert nested sequences in a single call
+                    label = to_tensor(label)
             else:
                 raise TypeError(
                     'The `pred` and `target` must be type of torch.tensor or '
                     f'np.ndarray or sequence but get {type(label)}.')
             return label
 
-        pred = _format_label(pred, pred_indices)
-        target = _format_label(target, target_indices).long()
+        if (isinstance(pred, torch.Tensor)
+                and isinstance(target, torch.Tensor) and pred.ndim == 2
+                and pred.shape == target.shape):
+            # Skip formatting the well-shaped tensors, which is the common
+            # case from `compute_metrics`.
+            target = target.long()
+        else:
+            pred = _format_label(pred, pred_indices)
+            target = _format_label(target, target_indices).long()
 
-        assert pred.shape == target.shape, \
-            f"The size of pred ({pred.shape}) doesn't match "\
-            f'the target ({target.shape}).'
+            assert pred.shape == target.shape, \
+                f"The size of pred ({pred.shape}) doesn't match "\
+                f'the target ({target.shape}).'
 
         if num_classes is not None:
             assert pred.size(1) == num_classes, \
@@ -354,23 +392,129 @@ class MultiLabelMetric(BaseMetric):
                 f"doesn't match the num_classes ({num_classes})."
         num_classes = pred.size(1)
 
-        thr = 0.5 if (thr is None and topk is None) else thr
-
         if thr is not None:
             # a label is predicted positive if larger than thr
-            pos_inds = (pred >= thr).long()
+            pos_inds = pred >= thr
         else:
             # top-k labels will be predicted positive for any example
-            _, topk_indices = pred.topk(topk)
-            pos_inds = torch.zeros_like(pred).scatter_(1, topk_indices, 1)
-            pos_inds = pos_inds.long()
+            # only the set of indices is used, skip sorting them
+            _, topk_indices = pred.topk(topk, dim=1, sorted=False)
+            pos_inds = torch.zeros_like(
+                pred, dtype=torch.bool).scatter_(1, topk_indices, True)
 
         return _precision_recall_f1_support(pos_inds, target, average)
 
 
+def _to_compute_device(pred: torch.Tensor, target: torch.Tensor,
+                       compute_device: Optional[str]):
+    """Move the collected results to ``compute_device`` if the score matrix
+    is large enough."""
+    if compute_device is None or pred.numel() <= COMPUTE_DEVICE_MIN_NUMEL:
+        return pred, target
+    return pred.to(compute_device), target.to(compute_device)
+
+
+def _index_labels_to_onehot(labels: List[torch.Tensor],
+                            num_classes: int) -> torch.Tensor:
+    """Convert the index labels of a batch to onehot format at once.
+
+    The sparse onehot labels of all samples are summed up by a single
+    ``index_add_`` instead of a split and a sum for every sample.
+
+    Args:
+        labels (List[torch.Tensor]): The index labels of every sample.
+        num_classes (int): The number of classes.
+
+    Returns:
+        torch.Tensor: The onehot format labels with shape
+        ``(len(labels), num_classes)``.
+    """
+    sparse_onehot = F.one_hot(torch.cat(labels), num_classes)
+    sample_inds = torch.repeat_interleave(
+        torch.tensor([label.size(0) for label in labels],
+                     device=sparse_onehot.device))
+    onehot = sparse_onehot.new_zeros((len(labels), num_classes))
+    return onehot.index_add_(0, sample_inds, sparse_onehot)
+
+
+def _batch_gt_onehot(data_samples: Sequence[dict],
+                     num_classes: int) -> List[torch.Tensor]:
+    """Get the onehot format ground-truth of a batch of data samples.
+
+    The ``gt_score`` of a sample is used if it exists, otherwise its
+    ``gt_label`` is converted to onehot format. The index labels of the whole
+    batch are converted at once.
+
+    Note:
+        The onehot rows of the ``gt_label`` share the storage of the whole
+        batch. Clone them before saving to avoid collecting the whole batch.
+
+    Args:
+        data_samples (Sequence[dict]): A batch of outputs from the model.
+        num_classes (int): The number of classes.
+
+    Returns:
+        List[torch.Tensor]: The onehot format ground-truth of every sample.
+    """
+    gt_onehots = [data_sample.get('gt_score') for data_sample in data_samples]
+    label_inds = [i for i, gt in enumerate(gt_onehots) if gt is None]
+    if len(label_inds) > 0:
+        gt_labels = [
+            format_label(data_samples[i]['gt_label']) for i in label_inds
+        ]
+        # Duplicated indices of a sample are counted once, the same as
+        # `MultiLabelMetric.calculate`.
+        onehots = _index_labels_to_onehot(gt_labels, num_classes).clamp_(max=1)
+        for i, onehot in zip(label_inds, onehots):
+            gt_onehots[i] = onehot
+    return gt_onehots
+
+
+def _index_label_keys(labels: Sequence, num_classes: int) -> torch.Tensor:
+    """Encode the index labels of every sample as unique keys.
+
+    The key of category ``c`` in the ``i``-th sample is
+    ``i * num_classes + c``.
+    """
+    labels = [format_label(label) for label in labels]
+    categories = torch.cat(labels)
+    assert ((categories >= 0) & (categories < num_classes)).all(), \
+        f'The index labels should be in range [0, {num_classes}).'
+    keys = torch.cat(
+        [label + i * num_classes for i, label in enumerate(labels)])
+    return torch.unique(keys)
+
+
+def _sparse_precision_recall_f1_support(pred: Sequence, target: Sequence,
+                                        num_classes: int,
+                                        average: Optional[str]):
+    """Calculate the precision, recall, f1-score and support from sequences
+    of index labels, without converting them to onehot format."""
+    assert len(pred) == len(target), \
+        f"The length of pred ({len(pred)}) doesn't match " \
+        f'the target ({len(target)}).'
+
+    pred_keys = _index_label_keys(pred, num_classes)
+    gt_keys = _index_label_keys(target, num_classes)
+
+    # The keys exist in both pred and target are true positive cases.
+    keys, counts = torch.unique(
+        torch.cat([pred_keys, gt_keys]), return_counts=True)
+    tp_keys = keys[counts > 1]
+
+    tp_sum = torch.bincount(tp_keys % num_classes, minlength=num_classes)
+    pred_sum = torch.bincount(pred_keys % num_classes, minlength=num_classes)
+    gt_sum = torch.bincount(gt_keys % num_classes, minlength=num_classes)
+    if average == 'micro':
+        tp_sum, pred_sum, gt_sum = tp_sum.sum(), pred_sum.sum(), gt_sum.sum()
+
+    return _precision_recall_f1_support_from_sums(tp_sum, pred_sum, gt_sum,
+                                                  average)
+
+
 def _average_precision(pred: torch.Tensor,
                        target: torch.Tensor) -> torch.Tensor:
-    r"""Calculate the average precision for a single class.
+    r"""Calculate the average precision for every class.
 
     AP summarizes a precision-recall curve as the weighted mean of maximum
     precisions obtained for any r'>r, where r is the recall:
@@ -388,7 +532,7 @@ def _average_precision(pred: torch.Tensor,
             ``(N, num_classes)``.
 
     Returns:
-        torch.Tensor: average precision result.
+        torch.Tensor: average precision result with shape ``(num_classes, )``.
     """
     assert pred.shape == target.shape, \
         f"The size of pred ({pred.shape}) doesn't match "\
@@ -397,30 +541,29 @@ def _average_precision(pred: torch.Tensor,
     # a small value for division by zero errors
     eps = torch.finfo(torch.float32).eps
 
+    # sort examples of all classes at once
+    sorted_pred_inds = torch.argsort(pred, dim=0, descending=True)
+    sorted_target = torch.gather(target, 0, sorted_pred_inds)
+
     # get rid of -1 target such as difficult sample
     # that is not wanted in evaluation results.
-    valid_index = target > -1
-    pred = pred[valid_index]
-    target = target[valid_index]
-
-    # sort examples
-    sorted_pred_inds = torch.argsort(pred, dim=0, descending=True)
-    sorted_target = target[sorted_pred_inds]
+    valid_inds = sorted_target > -1
 
     # get indexes when gt_true is positive
     pos_inds = sorted_target == 1
 
     # Calculate cumulative tp case numbers
     tps = torch.cumsum(pos_inds, 0)
-    total_pos = tps[-1].item()  # the last of tensor may change later
+    total_pos = tps[-1].float()
 
-    # Calculate cumulative tp&fp(pred_poss) case numbers
-    pred_pos_nums = torch.arange(1, len(sorted_target) + 1).to(pred.device)
-    pred_pos_nums[pred_pos_nums < eps] = eps
+    # Calculate cumulative tp&fp(pred_poss) case numbers, only the valid
+    # samples are counted. Clamp to 1 for the leading invalid samples, which
+    # are not positive anyway.
+    pred_pos_nums = torch.cumsum(valid_inds, 0).clamp_(min=1)
 
-    tps[torch.logical_not(pos_inds)] = 0
-    precision = tps / pred_pos_nums.float()
-    ap = torch.sum(precision, 0) / max(total_pos, eps)
+    # only sum up the precision at positive samples
+    precision = tps / pred_pos_nums * pos_inds
+    ap = torch.sum(precision, 0) / torch.clamp(total_pos, min=eps)
     return ap
 
 
@@ -450,6 +593,11 @@ class AveragePrecision(BaseMetric):
         collect_device (str): Device name used for collecting results from
             different ranks during distributed training. Must be 'cpu' or
             'gpu'. Defaults to 'cpu'.
+        compute_device (str, optional): Device name used for computing the
+            metrics from the collected results, like 'cuda'. The results are
+            moved only if the score matrix has more than
+            ``COMPUTE_DEVICE_MIN_NUMEL`` elements. Defaults to None, which
+            means computing on the device the results are collected to.
         prefix (str, optional): The prefix that will be added in the metric
             names to disambiguate homonymous metrics of different evaluators.
             If prefix is not provided in the argument, self.default_prefix
@@ -497,9 +645,11 @@ class AveragePrecision(BaseMetric):
     def __init__(self,
                  average: Optional[str] = 'macro',
                  collect_device: str = 'cpu',
+                 compute_device: Optional[str] = None,
                  prefix: Optional[str] = None) -> None:
         super().__init__(collect_device=collect_device, prefix=prefix)
         self.average = average
+        self.compute_device = compute_device
 
     def process(self, data_batch, data_samples: Sequence[dict]):
         """Process one batch of data samples.
@@ -512,17 +662,15 @@ class AveragePrecision(BaseMetric):
             data_samples (Sequence[dict]): A batch of outputs from the model.
         """
 
-        for data_sample in data_samples:
+        num_classes = data_samples[0]['pred_score'].size()[-1]
+
+        gt_scores = _batch_gt_onehot(data_samples, num_classes)
+
+        for data_sample, gt_score in zip(data_samples, gt_scores):
             result = dict()
 
             result['pred_score'] = data_sample['pred_score'].clone()
-            num_classes = result['pred_score'].size()[-1]
-
-            if 'gt_score' in data_sample:
-                result['gt_score'] = data_sample['gt_score'].clone()
-            else:
-                result['gt_score'] = label_to_onehot(data_sample['gt_label'],
-                                                     num_classes)
+            result['gt_score'] = gt_score.clone()
 
             # Save the result to `self.results`.
             self.results.append(result)
@@ -544,6 +692,7 @@ class AveragePrecision(BaseMetric):
         # concat
         target = torch.stack([res['gt_score'] for res in results])
         pred = torch.stack([res['pred_score'] for res in results])
+        pred, target = _to_compute_device(pred, target, self.compute_device)
 
         ap = self.calculate(pred, target, self.average)
 
@@ -589,10 +738,7 @@ class AveragePrecision(BaseMetric):
         assert pred.ndim == 2 and pred.shape == target.shape, \
             'Both `pred` and `target` should have shape `(N, num_classes)`.'
 
-        num_classes = pred.shape[1]
-        ap = pred.new_zeros(num_classes)
-        for k in range(num_classes):
-            ap[k] = _average_precision(pred[:, k], target[:, k])
+        ap = _average_precision(pred, target)
         if average == 'macro':
             return ap.mean() * 100.0
         else:
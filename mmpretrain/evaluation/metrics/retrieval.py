@@ -8,7 +8,7 @@ from mmengine.evaluator import BaseMetric
 from mmengine.utils import is_seq_of
 
 from mmpretrain.registry import METRICS
-from mmpretrain.structures import label_to_onehot
+from .multi_label import _batch_gt_onehot
 from .single_label import to_tensor
 
 
@@ -94,23 +94,20 @@ class RetrievalRecall(BaseMetric):
             data_batch (Sequence[dict]): A batch of data from the dataloader.
             predictions (Sequence[dict]): A batch of outputs from the model.
         """
-        for data_sample in data_samples:
-            pred_score = data_sample['pred_score'].clone()
-            gt_label = data_sample['gt_label']
-
-            if 'gt_score' in data_sample:
-                target = data_sample.get('gt_score').clone()
-            else:
-                num_classes = pred_score.size()[-1]
-                target = label_to_onehot(gt_label, num_classes)
-
-            # Because the retrieval output logit vector will be much larger
-            # compared to the normal classification, to save resources, the
-            # evaluation results are computed each batch here and then reduce
-            #  all results at the end.
-            result = RetrievalRecall.calculate(
-                pred_score.unsqueeze(0), target.unsqueeze(0), topk=self.topk)
-            self.results.append(result)
+        pred_score = torch.stack(
+            [data_sample['pred_score'] for data_sample in data_samples])
+        num_classes = pred_score.size()[-1]
+
+        target = torch.stack(_batch_gt_onehot(data_samples, num_classes))
+
+        # Because the retrieval output logit vector will be much larger
+        # compared to the normal classification, to save resources, the
+        # evaluation results are computed each batch here and then reduce
+        # all results at the end. The hits are still saved per sample.
+        pred = _format_pred(pred_score, max(self.topk))
+        target = _format_target(target)
+        hits = _retrieval_hits(pred, target, self.topk)
+        self.results.extend(hits.tolist())
 
     def compute_metrics(self, results: List):
         """Compute the metrics from processed results.
@@ -124,7 +121,7 @@ class RetrievalRecall(BaseMetric):
         """
         result_metrics = dict()
         for i, k in enumerate(self.topk):
-            recall_at_k = sum([r[i].item() for r in results]) / len(results)
+            recall_at_k = sum(r[i] for r in results) * 100 / len(results)
             result_metrics[f'Recall@{k}'] = recall_at_k
 
         return result_metrics
@@ -170,17 +167,56 @@ class RetrievalRecall(BaseMetric):
             f'Length of `pred`({len(pred)}) and `target` ({len(target)}) '
             f'must be the same.')
 
-        num_samples = len(pred)
-        results = []
-        for k in topk:
-            recalls = torch.zeros(num_samples)
-            for i, (sample_pred,
-                    sample_target) in enumerate(zip(pred, target)):
-                sample_pred = np.array(to_tensor(sample_pred).cpu())
-                sample_target = np.array(to_tensor(sample_target).cpu())
-                recalls[i] = int(np.in1d(sample_pred[:k], sample_target).max())
-            results.append(recalls.mean() * 100)
-        return results
+        hits = _retrieval_hits(pred, target, topk)
+        return [hits_k.float().mean() * 100 for hits_k in hits.unbind(1)]
+
+
+def _retrieval_hits(pred, target, topk):
+    """Check whether every sample hits its target in the top-k predictions.
+
+    Args:
+        pred (torch.Tensor | Sequence): The predicted indices of every sample,
+            sorted by the scores in descending order.
+        target (torch.Tensor | Sequence): The onehot targets with shape
+            ``(N, M)``, or the target indices of every sample.
+        topk (Sequence[int]): The k values to check.
+
+    Returns:
+        torch.Tensor: A bool tensor with shape ``(N, len(topk))``.
+    """
+    if isinstance(pred, torch.Tensor) and isinstance(target, torch.Tensor):
+        # Look up the onehot targets of the top predictions of all samples
+        # at once.
+        is_hit = target.to(pred.device).gather(1, pred) != 0
+        has_hit = is_hit.any(dim=1, keepdim=True)
+        first_hit = is_hit.int().argmax(dim=1, keepdim=True)
+        return has_hit & (first_hit < pred.new_tensor(topk))
+
+    max_keep = max(topk)
+    hits = []
+    for sample_pred, sample_target in zip(pred, target):
+        sample_pred = to_tensor(sample_pred)[:max_keep]
+        if isinstance(target, torch.Tensor):
+            # Use the onehot target as a bitmap and look up the predictions
+            # directly instead of searching the target indices. Indices out
+            # of the gallery, like the -1 padding of missing neighbors, are
+            # misses.
+            sample_target = sample_target.to(sample_pred.device)
+            num_gallery = sample_target.numel()
+            valid = (sample_pred >= 0) & (sample_pred < num_gallery)
+            is_hit = sample_target[sample_pred.clamp(0, num_gallery - 1)]
+            is_hit = (is_hit != 0) & valid
+        else:
+            # Keep the membership test on the device of the predictions to
+            # avoid a host synchronization for every sample.
+            sample_target = to_tensor(sample_target).to(sample_pred.device)
+            is_hit = (sample_pred[:, None] == sample_target).any(dim=1)
+
+        # The sample hits in the top-k predictions if the first hit ranks
+        # before k, so the membership test is done only once for all k.
+        first_hit = is_hit.int().argmax()
+        hits.append(is_hit.any() & (first_hit < sample_pred.new_tensor(topk)))
+    return torch.stack(hits)
 
 
 def _format_pred(label, topk=None, is_indices=False):
@@ -208,7 +244,7 @@ def _format_pred(label, topk=None, is_indices=False):
 
 
 def _format_target(label, is_indices=False):
-    """format various label to List[indices]."""
+    """format various label to List[indices] or onehot torch.Tensor."""
     if is_indices:
         assert isinstance(label, Sequence),  \
                 '`target` must be Sequence of indices when' \
@@ -227,6 +263,4 @@ def _format_target(label, is_indices=False):
     elif not isinstance(label, torch.Tensor):
         raise TypeError(f'The pred must be type of torch.tensor, '
                         f'np.ndarray or Sequence but get {type(label)}.')
-
-    indices = [sample_gt.nonzero().squeeze(-1) for sample_gt in label]
-    return indices
+    return label
@@ -33,8 +33,8 @@ def _precision_recall_f1_support(pred_positive, gt_positive, average):
     # in evaluation results.
     # only for calculate multi-label without affecting single-label behavior
     ignored_index = gt_positive == -1
-    pred_positive[ignored_index] = 0
-    gt_positive[ignored_index] = 0
+    pred_positive.masked_fill_(ignored_index, 0)
+    gt_positive.masked_fill_(ignored_index, 0)
 
     class_correct = (pred_positive & gt_positive)
     if average == 'micro':
@@ -46,6 +46,13 @@ def _precision_recall_f1_support(pred_positive, gt_positive, average):
         pred_sum = pred_positive.sum(0)
         gt_sum = gt_positive.sum(0)
 
+    return _precision_recall_f1_support_from_sums(tp_sum, pred_sum, gt_sum,
+                                                  average)
+
+
+def _precision_recall_f1_support_from_sums(tp_sum, pred_sum, gt_sum, average):
+    """calculate precision, recall, f1_score and support from the sums of
+    true positive, predicted positive and ground-truth positive cases."""
     precision = tp_sum / torch.clamp(pred_sum, min=1).float() * 100
     recall = tp_sum / torch.clamp(gt_sum, min=1).float() * 100
     f1_score = 2 * precision * recall / torch.clamp(
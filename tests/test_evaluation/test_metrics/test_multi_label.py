@@ -1,5 +1,6 @@
 # Copyright (c) OpenMMLab. All rights reserved.
 from unittest import TestCase
+from unittest.mock import patch
 
 import numpy as np
 import sklearn.metrics
@@ -59,6 +60,68 @@ class TestMultiLabel(TestCase):
         self.assertTensorEqual(f1_score, expect_f1)
         self.assertTensorEqual(support, 7)
 
+        # Test with sequence of category indexes and other average modes
+        precision, recall, f1_score, support = MultiLabelMetric.calculate(
+            y_pred,
+            y_true,
+            pred_indices=True,
+            target_indices=True,
+            average='micro',
+            num_classes=4)
+        self.assertTensorEqual(
+            precision,
+            sklearn.metrics.precision_score(
+                y_true_binary, y_pred_binary, average='micro') * 100)
+        self.assertTensorEqual(
+            recall,
+            sklearn.metrics.recall_score(
+                y_true_binary, y_pred_binary, average='micro') * 100)
+        self.assertTensorEqual(support, 7)
+        precision, *_, support = MultiLabelMetric.calculate(
+            y_pred,
+            y_true,
+            pred_indices=True,
+            target_indices=True,
+            average=None,
+            num_classes=4)
+        np.testing.assert_allclose(
+            precision,
+            sklearn.metrics.precision_score(
+                y_true_binary, y_pred_binary, average=None) * 100)
+        self.assertEqual(support.tolist(), [2, 2, 1, 2])
+
+        # Test with duplicated category indexes, which are counted once on
+        # both the sparse and the dense paths.
+        sparse_res = MultiLabelMetric.calculate([[1], [2]], [[1], [2, 2]],
+                                                pred_indices=True,
+                                                target_indices=True,
+                                                average=None,
+                                                num_classes=3)
+        dense_res = MultiLabelMetric.calculate(
+            torch.tensor([[0, 1, 0], [0, 0, 1]]), [[1], [2, 2]],
+            target_indices=True,
+            average=None,
+            num_classes=3)
+        topk_res = MultiLabelMetric.calculate(
+            torch.tensor([[0.1, 0.8, 0.1], [0.1, 0.1, 0.8]]), [[1], [2, 2]],
+            target_indices=True,
+            average=None,
+            topk=1,
+            num_classes=3)
+        for res in (sparse_res, dense_res, topk_res):
+            precision, *_, support = res
+            self.assertEqual(precision.tolist(), [0., 100., 100.])
+            self.assertEqual(support.tolist(), [0, 1, 1])
+
+        # Test with out-of-range category indexes
+        with self.assertRaisesRegex(AssertionError, 'should be in range'):
+            MultiLabelMetric.calculate(
+                y_pred,
+                y_true,
+                pred_indices=True,
+                target_indices=True,
+                num_classes=3)
+
         # Test with onehot input
         res = MultiLabelMetric.calculate(y_pred_binary,
                                          torch.from_numpy(y_true_binary))
@@ -177,6 +240,29 @@ class TestMultiLabel(TestCase):
         self.assertEqual(res['multi-label/recall'], expect_recall)
         self.assertEqual(res['multi-label/f1-score'], expect_f1)
 
+        # Test with compute_device
+        with patch(
+                'mmpretrain.evaluation.metrics.multi_label.'
+                'COMPUTE_DEVICE_MIN_NUMEL', 0):
+            evaluator = Evaluator(
+                dict(type='MultiLabelMetric', compute_device='cpu'))
+            evaluator.process(pred)
+            res = evaluator.evaluate(4)
+        self.assertEqual(res['multi-label/precision'], expect_precision)
+        self.assertEqual(res['multi-label/recall'], expect_recall)
+        self.assertEqual(res['multi-label/f1-score'], expect_f1)
+
+        # Test with duplicated gt_label, which is counted once
+        dup_pred = [
+            DataSample(num_classes=3).set_pred_score(
+                torch.tensor([0.9, 0.1, 0.1])).set_gt_label([0, 0])
+        ]
+        evaluator = Evaluator(dict(type='MultiLabelMetric', average='micro'))
+        evaluator.process(dup_pred)
+        res = evaluator.evaluate(1)
+        self.assertEqual(res['multi-label/precision_micro'], 100.)
+        self.assertEqual(res['multi-label/recall_micro'], 100.)
+
         # Test with topk argument
         evaluator = Evaluator(dict(type='MultiLabelMetric', topk=1))
         evaluator.process(pred)
@@ -326,6 +412,16 @@ class TestAveragePrecision(TestCase):
         self.assertAlmostEqual(aps[2], 100, places=4)
         self.assertAlmostEqual(aps[3], 0, places=4)
 
+        # Test with compute_device
+        with patch(
+                'mmpretrain.evaluation.metrics.multi_label.'
+                'COMPUTE_DEVICE_MIN_NUMEL', 0):
+            evaluator = Evaluator(
+                dict(type='AveragePrecision', compute_device='cpu'))
+            evaluator.process(pred)
+            res = evaluator.evaluate(5)
+        self.assertAlmostEqual(res['multi-label/mAP'], 70.83333, places=4)
+
         # Test with gt_label without score
         pred = [
             DataSample(num_classes=4).set_pred_score(i).set_gt_label(j)
@@ -336,6 +432,22 @@ class TestAveragePrecision(TestCase):
         res = evaluator.evaluate(5)
         self.assertAlmostEqual(res['multi-label/mAP'], 70.83333, places=4)
 
+        # Test with gt_score and gt_label mixed in one batch
+        pred = [
+            DataSample(num_classes=4).set_pred_score(y_pred[0]).set_gt_label(
+                [0, 1]),
+            DataSample(num_classes=4).set_pred_score(y_pred[1]).set_gt_score(
+                y_true[1]),
+            DataSample(num_classes=4).set_pred_score(y_pred[2]).set_gt_label(
+                [2]),
+            DataSample(num_classes=4).set_pred_score(y_pred[3]).set_gt_score(
+                y_true[3]),
+        ]
+        evaluator = Evaluator(dict(type='AveragePrecision'))
+        evaluator.process(pred)
+        res = evaluator.evaluate(5)
+        self.assertAlmostEqual(res['multi-label/mAP'], 70.83333, places=4)
+
     def test_calculate(self):
         """Test using the metric from static method."""
 
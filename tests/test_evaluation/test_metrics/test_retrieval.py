@@ -85,6 +85,21 @@ class TestRetrievalRecall(TestCase):
         for i in range(len(expect_recalls)):
             self.assertEqual(recall_score[i].item(), expect_recalls[i])
 
+        # test with indices pred and onehot target
+        y_pred = [np.arange(10)] * 2
+        recall_score = RetrievalRecall.calculate(
+            y_pred, y_true, topk=(1, 5), pred_indices=True)
+        for i in range(len(expect_recalls)):
+            self.assertEqual(recall_score[i].item(), expect_recalls[i])
+
+        # test with negative and out-of-range indices pred, which are misses
+        y_pred = [np.array([-1, 10, 2]), np.array([10, -1, 4])]
+        recall_score = RetrievalRecall.calculate(
+            y_pred, y_true, topk=(1, 3), pred_indices=True)
+        expect_recalls = [0., 100.]
+        for i in range(len(expect_recalls)):
+            self.assertEqual(recall_score[i].item(), expect_recalls[i])
+
         # Test with invalid pred
         y_pred = dict()
         y_true = [[0, 2, 5, 8, 9], [1, 4, 6]]